@@ -0,0 +1,68 @@
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import serve_fixtures
+
+# Peak memory of get_historic_meteociel on a long synthetic range, with and
+# without max_memory_mb (spill to disk). Each run is a fresh process, so the
+# peak RSS (ru_maxrss, Linux/macOS only) of one mode doesn't hide the other.
+#
+# Ex: python -m benchmarks.historic_memory --start 1994-01-01 --end 2023-12-31
+
+
+def run(start_date, end_date, max_memory_mb=None):
+    from get_meteo.get_meteo_data import get_historic_meteociel
+
+    serve_fixtures()
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        df, path = get_historic_meteociel(
+            start_date,
+            end_date,
+            "7157",
+            csv_export=True,
+            filepath=tmp + "/",
+            max_memory_mb=max_memory_mb,
+        )
+        with open(path) as f:
+            n_rows = sum(1 for _ in f) - 1
+    seconds = time.perf_counter() - started
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux gives kB, macOS bytes
+    max_rss_mb = max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+    mode = f"max_memory_mb={max_memory_mb}" if max_memory_mb else "no spill"
+    print(f"{mode:<18} rows={n_rows} time={seconds:.0f}s peak_rss={max_rss_mb:.0f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start", default="1994-01-01")
+    parser.add_argument("--end", default="2023-12-31")
+    parser.add_argument("--max-memory-mb", type=float, nargs="*", default=[0, 20])
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run(args.start, args.end, args.max_memory_mb[0] or None)
+    else:
+        for max_memory_mb in args.max_memory_mb:
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.historic_memory",
+                    "--single",
+                    "--start",
+                    args.start,
+                    "--end",
+                    args.end,
+                    "--max-memory-mb",
+                    str(max_memory_mb),
+                ],
+                check=True,
+            )
@@ -0,0 +1,51 @@
+import argparse
+import subprocess
+import sys
+
+# Time and memory of importing the scrapers in a fresh interpreter (best of --repeat),
+# and whether pandas got loaded by the import.
+#
+# Ex: python -m benchmarks.import_time --module get_meteo.get_meteo_data
+
+MEASURE = """
+import resource, sys, time
+started = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - started
+max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+max_rss_mb = max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+print(seconds * 1000, max_rss_mb, "pandas" in sys.modules)
+"""
+
+
+def measure_import(module, repeat=5):
+    """
+    Output: best import time (ms), peak RSS (MB) of that run and if pandas was loaded.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE.format(module=module)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        runs.append((float(output[0]), float(output[1]), output[2] == "True"))
+    return min(runs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--module",
+        nargs="*",
+        default=["get_meteo.get_meteo_data", "get_meteo.get_live_data"],
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for module in args.module:
+        ms, rss_mb, pandas_loaded = measure_import(module, args.repeat)
+        print(
+            f"{module:<28} import={ms:.0f}ms peak_rss={rss_mb:.0f}MB pandas_loaded={pandas_loaded}"
+        )
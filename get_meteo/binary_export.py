@@ -0,0 +1,195 @@
+import json
+import os
+
+import numpy as np
+
+# Binary export: a folder with one .npy file per column and a meta.json header.
+# The .npy files have fixed dtypes, so they can be memory-mapped (np.load(..., mmap_mode="r"))
+# and sliced without a full load.
+# Time columns (time_columns) are float64 seconds since 1970-01-01 00:00:00 in the wall-clock
+# time of their timezone (nan if missing), the unit and timezone are in meta.json: they are
+# readable by MATLAB and any .npy reader, eg. datetime(x, "ConvertFrom", "posixtime").
+# OBS: the other columns are float64 or fixed width unicode (not readable by every .npy reader),
+# datetime64[ns] columns are only written in the internal spill chunks.
+
+META_FILE = "meta.json"
+TIME_UNIT = "s"
+TIME_EPOCH = "1970-01-01 00:00:00"
+
+
+def get_column_array(values):
+    """
+    Input: column (pandas Series or numpy array).
+    Output: numpy array with a fixed dtype, objects (strings, mixed) become fixed width unicode.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "biuf":
+        return values.astype(np.float64)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ns]")
+    if values.dtype.kind == "U":
+        return values
+    return np.array(
+        ["" if value is None or value != value else str(value) for value in values],
+        dtype=str,
+    )
+
+
+def get_time_array(values):
+    """
+    Input: column of datetimes (datetime64 or "yyyy-mm-dd HH:MM:SS" strings, "" for missing).
+    Output: float64 array of seconds since TIME_EPOCH (wall-clock), nan where missing.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind != "M":
+        values = np.array(
+            ["NaT" if value is None or value != value else value for value in values],
+            dtype="datetime64[s]",
+        )
+    seconds = values.astype("datetime64[s]")
+    out = seconds.astype(np.int64).astype(np.float64)
+    out[np.isnat(seconds)] = np.nan
+    return out
+
+
+def get_column_meta(name, dtype, time_columns=None):
+    column = {"name": name, "dtype": dtype}
+    if time_columns and name in time_columns:
+        column.update(unit=TIME_UNIT, epoch=TIME_EPOCH, timezone=time_columns[name])
+    return column
+
+
+def write_meta(dirpath, columns, n_rows, metadata=None):
+    # columns: list of dicts with the name and dtype (and the time unit of time columns)
+    meta = {
+        "n_rows": int(n_rows),
+        "columns": [dict(column, file=f"{i}.npy") for i, column in enumerate(columns)],
+        "metadata": metadata or {},
+    }
+    with open(os.path.join(dirpath, META_FILE), "w") as f:
+        json.dump(meta, f, indent=1)
+
+
+def read_meta(dirpath):
+    with open(os.path.join(dirpath, META_FILE)) as f:
+        return json.load(f)
+
+
+def binary_export_df(df, dirpath, metadata=None, time_columns=None):
+    """
+    Inputs:
+        df: pandas DataFrame to export.
+        dirpath: folder of the export, created if needed.
+        metadata: dict saved in the meta.json header (eg. station, timezone), optional.
+        time_columns: dict {column name: timezone} of the columns saved as epoch seconds
+            (see get_time_array), optional.
+    Output: dirpath
+    """
+    time_columns = time_columns or {}
+    os.makedirs(dirpath, exist_ok=True)
+    columns = []
+    for i, name in enumerate(df.columns):
+        if name in time_columns:
+            values = get_time_array(df[name].to_numpy())
+        else:
+            values = get_column_array(df[name].to_numpy())
+        np.save(os.path.join(dirpath, f"{i}.npy"), values, allow_pickle=False)
+        columns.append(get_column_meta(name, values.dtype.str, time_columns))
+    write_meta(dirpath, columns, len(df), metadata)
+    return dirpath
+
+
+def binary_export_chunks(chunk_dirs, dirpath, metadata=None, time_columns=None):
+    """
+    Streams binary exported chunks (same format) into a single export, column by column,
+    without loading more than one chunk column at a time. Columns missing in a chunk are
+    filled with nan, NaT or "". time_columns: see binary_export_df, optional.
+    Output: dirpath
+    """
+    time_columns = time_columns or {}
+    metas = [read_meta(chunk_dir) for chunk_dir in chunk_dirs]
+    n_rows = sum(meta["n_rows"] for meta in metas)
+
+    # Union of the columns in order of appearance, strings take the widest dtype
+    dtypes = {}
+    for meta in metas:
+        for col in meta["columns"]:
+            dtype = np.dtype(col["dtype"])
+            previous = dtypes.get(col["name"])
+            if col["name"] in time_columns:
+                dtypes[col["name"]] = np.dtype(np.float64)
+            elif previous is None:
+                dtypes[col["name"]] = dtype
+            elif previous.kind == "U" or dtype.kind == "U":
+                width = (
+                    max(
+                        previous.itemsize if previous.kind == "U" else 0,
+                        dtype.itemsize if dtype.kind == "U" else 0,
+                    )
+                    // 4
+                )
+                dtypes[col["name"]] = np.dtype(f"<U{max(width, 3)}")
+
+    os.makedirs(dirpath, exist_ok=True)
+    for i, (name, dtype) in enumerate(dtypes.items()):
+        out = np.lib.format.open_memmap(
+            os.path.join(dirpath, f"{i}.npy"), mode="w+", dtype=dtype, shape=(n_rows,)
+        )
+        fill = {"U": "", "M": np.datetime64("NaT")}.get(dtype.kind, np.nan)
+        start = 0
+        for chunk_dir, meta in zip(chunk_dirs, metas):
+            files = {col["name"]: col["file"] for col in meta["columns"]}
+            end = start + meta["n_rows"]
+            if name in files:
+                values = np.load(os.path.join(chunk_dir, files[name]), mmap_mode="r")
+                if name in time_columns:
+                    out[start:end] = get_time_array(values)
+                else:
+                    out[start:end] = values.astype(dtype)
+            else:
+                out[start:end] = fill
+            start = end
+        out.flush()
+        del out
+
+    write_meta(
+        dirpath,
+        [
+            get_column_meta(name, dtype.str, time_columns)
+            for name, dtype in dtypes.items()
+        ],
+        n_rows,
+        metadata,
+    )
+    return dirpath
+
+
+def load_binary_export(dirpath, mmap_mode="r"):
+    """
+    Inputs:
+        dirpath: folder written by binary_export_df.
+        mmap_mode: mode of np.load, "r" memory-maps the columns (default), None loads them.
+    Output: dict {column name: numpy array} and the metadata dict.
+        Time columns are the float64 epoch seconds, see read_meta(dirpath)["columns"] for their timezone.
+    """
+    meta = read_meta(dirpath)
+    columns = {
+        col["name"]: np.load(os.path.join(dirpath, col["file"]), mmap_mode=mmap_mode)
+        for col in meta["columns"]
+    }
+    return columns, meta["metadata"]
+
+
+def load_binary_export_df(dirpath):
+    """
+    Output: pandas DataFrame with the columns of a binary export (fully loaded),
+        time columns are converted back to datetimes (wall-clock time of their timezone).
+    """
+    import pandas as pd
+
+    columns, _ = load_binary_export(dirpath, mmap_mode=None)
+    df = pd.DataFrame(columns)
+    for col in read_meta(dirpath)["columns"]:
+        if col.get("unit") == TIME_UNIT:
+            df[col["name"]] = pd.to_datetime(df[col["name"]], unit=TIME_UNIT)
+    return df
@@ -0,0 +1,201 @@
+import asyncio
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import json
+import os
+import time
+
+from get_meteo.get_meteo_data import fetch_meteociel_day, get_records_from_columns
+
+
+def load_last_seen(state_path):
+    """
+    Output: dict {station: {day: datetime (local) of the last emitted observation of that day or None}}
+        with the days still followed.
+    """
+    try:
+        with open(state_path) as f:
+            return {
+                station: {
+                    day: None if last is None else datetime.fromisoformat(last)
+                    for day, last in days.items()
+                }
+                for station, days in json.load(f).items()
+            }
+    except FileNotFoundError:
+        return {}
+
+
+def save_last_seen(last_seen, state_path):
+    os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+    with open(state_path, "w") as f:
+        json.dump(
+            {
+                station: {
+                    day: None if last is None else last.isoformat()
+                    for day, last in days.items()
+                }
+                for station, days in last_seen.items()
+            },
+            f,
+        )
+
+
+class MeteocielTail:
+    """
+    Polls the current-day page of a set of stations and keeps only the rows
+    newer than the last seen observation of each station and day.
+    After local midnight the previous day keeps being polled (late rows, failed fetches)
+    until a successful read once rollover_grace seconds have passed, and at most for
+    rollover_max seconds: a day still failing then is given up (logged).
+    Inputs:
+        stations: list of station numbers, integer or string format.
+        timezone: timezone of the stations, used to know the current local day.
+        state_path: json file where the last seen timestamps are kept between runs, optional.
+        rollover_grace: seconds after local midnight during which the previous day is still read.
+        rollover_max: seconds after the end of a day after which it is no longer read, even if
+            its page never loaded (the requests per poll don't grow while the site refuses them).
+    """
+
+    def __init__(
+        self,
+        stations,
+        timezone="Europe/Paris",
+        state_path="",
+        rollover_grace=7200,
+        rollover_max=21600,
+    ):
+        self.stations = [str(station) for station in stations]
+        self.timezone = timezone
+        self.state_path = state_path
+        self.rollover_grace = rollover_grace
+        self.rollover_max = rollover_max
+        # {station: {day: last emitted datetime of the day or None}}, only the followed days
+        self.last_seen = load_last_seen(state_path) if state_path else {}
+
+    def poll(self):
+        """
+        Output: dict {station: list of new MeteocielRecord sorted by date}, only stations with new rows.
+        """
+        now = datetime.now(ZoneInfo(self.timezone))
+        today = now.strftime("%Y-%m-%d")
+        now_local = now.replace(tzinfo=None)
+
+        new_records = {}
+        changed = False
+        for station in self.stations:
+            days = self.last_seen.setdefault(station, {})
+            if today not in days:
+                days[today] = None
+                changed = True
+
+            records = []
+            for day in sorted(days):
+                table_data, status = fetch_meteociel_day(day, station, use_cache=False)
+                # Seconds since the local midnight ending the day (negative for today)
+                day_end = datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)
+                age = (now_local - day_end).total_seconds()
+
+                # A failed fetch keeps the day followed, its rows are read at a next poll
+                if status == "error":
+                    if day < today and age >= self.rollover_max:
+                        print("******")
+                        print(
+                            f"Giving up {day} of station {station}, rows after "
+                            f"{days[day] or 'the start of the day'} not read"
+                        )
+                        print("******")
+                        del days[day]
+                        changed = True
+                    continue
+
+                last = days[day]
+                day_records = [
+                    record
+                    for record in get_records_from_columns(table_data)
+                    if last is None or record.date > last
+                ]
+                if day_records:
+                    days[day] = day_records[-1].date
+                    records += day_records
+                    changed = True
+
+                if day < today and age >= self.rollover_grace:
+                    del days[day]
+                    changed = True
+
+            if records:
+                new_records[station] = sorted(records, key=lambda record: record.date)
+
+        if changed and self.state_path:
+            save_last_seen(self.last_seen, self.state_path)
+
+        return new_records
+
+
+def tail_meteociel(
+    stations,
+    callback,
+    interval=300,
+    timezone="Europe/Paris",
+    state_path="",
+    max_polls=None,
+    rollover_grace=7200,
+    rollover_max=21600,
+):
+    """
+    Inputs:
+        stations: list of station numbers, integer or string format.
+        callback: called as callback(station, records) with the new MeteocielRecord of a station.
+        interval: seconds between the start of two polls.
+        timezone: timezone of the stations, the page followed rolls over at local midnight.
+        state_path: json file with the last seen timestamp of each station, optional.
+        max_polls: stops after this number of polls, optional (runs forever by default).
+        rollover_grace: seconds after local midnight during which the previous day is still read.
+        rollover_max: seconds after the end of a day after which a failing day is given up.
+    """
+    tail = MeteocielTail(stations, timezone, state_path, rollover_grace, rollover_max)
+    n_polls = 0
+    while max_polls is None or n_polls < max_polls:
+        started = time.monotonic()
+        for station, records in tail.poll().items():
+            callback(station, records)
+        n_polls += 1
+        if max_polls is None or n_polls < max_polls:
+            time.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+async def atail_meteociel(
+    stations,
+    interval=300,
+    timezone="Europe/Paris",
+    state_path="",
+    max_polls=None,
+    rollover_grace=7200,
+    rollover_max=21600,
+):
+    """
+    Async iterator version of tail_meteociel, yields (station, records) with the new rows.
+    Example:
+        async for station, records in atail_meteociel(["7157"], interval=120):
+            ...
+    """
+    tail = MeteocielTail(stations, timezone, state_path, rollover_grace, rollover_max)
+    n_polls = 0
+    while max_polls is None or n_polls < max_polls:
+        started = time.monotonic()
+        # The scraping is blocking, it runs in a thread to keep the event loop free
+        new_records = await asyncio.to_thread(tail.poll)
+        for station, records in new_records.items():
+            yield station, records
+        n_polls += 1
+        if max_polls is None or n_polls < max_polls:
+            await asyncio.sleep(max(0, interval - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    tail_meteociel(
+        ["7157"],
+        lambda station, records: print(station, records),
+        interval=300,
+    )
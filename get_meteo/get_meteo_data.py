@@ -1,10 +1,17 @@
-import requests
-from bs4 import BeautifulSoup
-import pandas as pd
 import re
-from datetime import datetime, timedelta, date
-import numpy as np
+from collections import namedtuple
+from datetime import datetime, timedelta, date, timezone as dt_timezone
+from zoneinfo import ZoneInfo
+import json
 import os
+import tempfile
+
+from get_meteo.single_flight import SingleFlight
+
+# pandas, numpy, requests and bs4 are imported inside the functions using them,
+# so importing this module (and the record mode) stays cheap.
+
+NAN = float("nan")
 
 
 def validate_date(date_text):
@@ -66,277 +73,423 @@ def get_info_from_url(url):
     return date, station
 
 
-def get_meteociel_data(
-    date="2023-01-01",
-    meteostation="7157",
-    url="",
-    csv_export=False,
-    filepath="files/meteo_tables/meteociel_scraping/",
-):
-    """
-    Inputs:
-        date: [yyyy-mm-dd] string format, optional.
-        meteostation: number of station, integer or string format, optional.
-        url: If given will ignore date and station, optional.
-    Output:
-        df with meteociel data for the given date and station.
-    """
-    # Building the url if it was not given
-    if not url:
-        # Validate the date input and build the url
-        validate_date(date)
-        annee = date[0:4]
-        mois = date[5:7]
-        jour = date[8:10]
-        url = f"https://www.meteociel.fr/temps-reel/obs_villes.php?code2={meteostation}&jour2={jour}&mois2={int(mois)-1}&annee2={annee}"
-        # print(url)
+# Empty station-days newer than this are not negative cached, the page may still be filled.
+NEGATIVE_CACHE_MIN_AGE_DAYS = 2
+# Approximate memory of one scraped cell (python object and list slot), to size the chunks of max_memory_mb
+CELL_BYTES = 64
+
+# Shared by the threads of the process: identical page requests are fetched and parsed once.
+meteociel_flight = SingleFlight(maxsize=128, ttl=30)
+
+# Cells considered as "no data" in the meteociel tables.
+EMPTY_CELLS = (" ", "", "\xa0", "\xa0 ", "&nbsp")
+
+# Meteociel header names to output column names.
+COLUMNS_NAMES = {
+    "Néb.": "nebulosity_octas",
+    "Temps": "temps",
+    "Visi": "visibility_km",
+    "Température": "temp_degC",
+    "Humi.": "humidity_%",
+    "Point de rosée": "pt_rosee_degC",
+    "Humidex": "humidex",
+    "Windchill": "windchill",
+    "Vent Moyen": "mean_wind_speed_km_h",
+    "Rafales Max": "rafales_max_km_h",
+    "Pression": "pression_hPa",
+    "Précip. mm/h": "precipitation_mm",
+    "Max rain rate": "max_rain_rate_mm_h",
+}
+
+# Fields of the MeteocielRecord, "humidity_%" is not a valid attribute name.
+RECORD_FIELDS = {
+    "date": "date",
+    "nebulosity_octas": "nebulosity_octas",
+    "visibility_km": "visibility_km",
+    "temp_degC": "temp_degC",
+    "humidity_%": "humidity_pct",
+    "pt_rosee_degC": "pt_rosee_degC",
+    "humidex": "humidex",
+    "windchill": "windchill",
+    "mean_wind_speed_km_h": "mean_wind_speed_km_h",
+    "rafales_max_km_h": "rafales_max_km_h",
+    "wind_direction_deg": "wind_direction_deg",
+    "pression_hPa": "pression_hPa",
+    "precipitation_mm": "precipitation_mm",
+    "max_rain_rate_mm_h": "max_rain_rate_mm_h",
+}
+
+# Compact row of a meteociel table, columns missing in the page are nan.
+MeteocielRecord = namedtuple(
+    "MeteocielRecord",
+    list(RECORD_FIELDS.values()),
+    defaults=[NAN] * (len(RECORD_FIELDS) - 1),
+)
+
+
+def find_numbers_in_string(input_string):
+    if input_string == "":
+        return NAN
     else:
-        date, meteostation = get_info_from_url(url)
+        pattern = r"-?\d+\.\d+|-?\d+"
+        found_numbers = re.findall(pattern, input_string)
+        numbers_as_string = "".join(found_numbers)
 
-    try:
-        # Hosting request
-        r = requests.get(url)
+        return numbers_as_string
 
-        # Parsing html
-        soup = BeautifulSoup(r.text, "lxml")
 
-        # Getting table element
-        table = soup.find("table", bgcolor="#EBFAF7")
+# Getting wind direction data from the popover
+def get_wind_dir(wind_dir_popover):
+    deg_i = wind_dir_popover.find("°")
+    wind_dir_temp = wind_dir_popover[deg_i - 4 : deg_i + 2]
+    wind_dir = find_numbers_in_string(wind_dir_temp)
+    return wind_dir
+
 
-        # Header
+def get_precipitation(x):
+    if "aucune" in x:
+        return 0.0
+    elif "m" in x:
+        height = float(find_numbers_in_string(x[: x.find("m")]))
         try:
-            header = table.find("tr")
-        except Exception as e:
-            # Data not avaiable, returns empty dataframe.
-            # Ex URL: set one avaiable to a future date.
-            print(e)
-            return pd.DataFrame({}), ""
+            time = float(find_numbers_in_string(x[x.find("(") : x.find(")")]))
+        except:
+            time = 1
+        return height
+        # Implementing rate == height/time is not consistent with some tables from meteociel
+        return height / time
+        # return round(height / time, 2)
+    else:
+        return NAN
 
-        headers = [head.text for head in header.find_all("td")]
 
-        # Vent (rafales) is a multicolumn, I will later separate its data into two columns if there is 2 data or into 1 column if there is only 1 data.
-        vent_i = headers.index("Vent (rafales)")
+def get_table_datetime(x, date):
+    # Adjust time data to unique format with date
+    date_format = "%Y-%m-%d %H:%M:%S"
+    if x[-1] != "h":
+        return datetime.strptime(
+            (date + " " + x.replace("h", ":").replace(" ", "") + ":00"),
+            date_format,
+        )
+    else:
+        return datetime.strptime(
+            (date + " " + x.replace("h", ":00").replace(" ", "") + ":00"),
+            date_format,
+        )
 
-        # Data from the rows
-        rows_data = [
-            [row_data.text for row_data in row.find_all("td")]
-            for row in header.find_next_siblings()
-        ]
 
-        # If table is empty, only with headers
-        if len(rows_data) == 0:
-            # print("Empty Table", url)
-            return pd.DataFrame({}), ""
+def build_meteociel_url(date, meteostation):
+    # Validate the date input and build the url
+    validate_date(date)
+    annee = date[0:4]
+    mois = date[5:7]
+    jour = date[8:10]
+    return f"https://www.meteociel.fr/temps-reel/obs_villes.php?code2={meteostation}&jour2={jour}&mois2={int(mois)-1}&annee2={annee}"
 
-        def find_numbers_in_string(input_string):
-            if input_string == "":
-                return np.nan
-            else:
-                pattern = r"-?\d+\.\d+|-?\d+"
-                found_numbers = re.findall(pattern, input_string)
-                numbers_as_string = "".join(found_numbers)
 
-                return numbers_as_string
+def get_meteociel_page(url):
+    """
+    Input: url of a meteociel observation page.
+    Output: bs4 soup of the page.
+    """
+    # requests and bs4 are only needed once a page is scraped
+    import requests
+    from bs4 import BeautifulSoup
 
-        # Getting wind direction data from the popover
-        def get_wind_dir(wind_dir_popover):
-            deg_i = wind_dir_popover.find("°")
-            wind_dir_temp = wind_dir_popover[deg_i - 4 : deg_i + 2]
-            wind_dir = find_numbers_in_string(wind_dir_temp)
-            return wind_dir
+    # Hosting request, refused or failed pages (429, 5xx...) are errors, not days without data
+    r = requests.get(url)
+    r.raise_for_status()
 
-        wind_dirs = []
-        for row in header.find_next_siblings():
-            try:
-                wind_dir = get_wind_dir(
-                    row.find_all("td")[vent_i].div.img.attrs["onmouseover"]
-                )
-                wind_dirs.append(float(wind_dir))
-            except:
-                # Some dates don't have the wind direction
-                wind_dirs.append(np.nan)
-
-        vent_row_0 = rows_data[0][vent_i + 1]
-        if "(" in vent_row_0:
-            # 2 data in the same field: Vent Moyen and rafales max, concatenated in the same header (multicolumn header)
-            headers = (
-                headers[0:vent_i]
-                + ["Vent Moyen", "Rafales Max", "wind_direction_deg"]
-                + headers[vent_i + 1 :]
-            )
-            #
-            vent_moyens = [
-                float(
-                    find_numbers_in_string(
-                        row_data[vent_i + 1][: row_data[vent_i + 1].find("(") - 2]
-                    )
-                    if row_data[vent_i + 1].find("/") != -1
-                    else np.nan
-                )
-                # row_data[vent_i + 1][: row_data[vent_i + 1].find("(") - 2]
-                for row_data in rows_data
-            ]
-            #
-            rafales_max = [
+    # Parsing html
+    return BeautifulSoup(r.text, "lxml")
+
+
+def parse_meteociel_table(table, date, url="", columns=None):
+    """
+    Inputs:
+        table: bs4 table element (bgcolor #EBFAF7) of a page from get_meteociel_page.
+        date: [yyyy-mm-dd] string format, date of the table.
+        url: only used in the problem columns report, optional.
+        columns: list of the output columns to extract, the cells of the others are not read, optional.
+            "date" is always extracted, names not in the page are ignored.
+    Output:
+        dict {column name: list of values} sorted by date, empty if the table has no rows.
+        No pandas or numpy objects are built here.
+    """
+    wanted = None if columns is None else set(columns) | {"date"}
+
+    # Header
+    header = table.find("tr")
+    headers = [head.text for head in header.find_all("td")]
+
+    # Vent (rafales) is a multicolumn: the cell vent_i has the direction popover and vent_i + 1 the speeds.
+    # Its data is later separated into two columns if there is 2 data or into 1 column if there is only 1 data.
+    vent_i = headers.index("Vent (rafales)")
+
+    rows = [row.find_all("td") for row in header.find_next_siblings()]
+
+    # If table is empty, only with headers
+    if len(rows) == 0:
+        return {}
+
+    n_cells = len(headers) + 1
+    if any(len(cells) > n_cells for cells in rows):
+        raise ValueError(f"{n_cells} columns passed, rows have more columns")
+
+    # 2 data in the same field: Vent Moyen and rafales max, or only Vent Moyen
+    gust = "(" in rows[0][vent_i + 1].text
+
+    # Output columns in the table order with the cell they come from
+    specs = []
+    for j, head in enumerate(headers):
+        if j == vent_i:
+            specs.append(("mean_wind_speed_km_h", "wind_mean"))
+            if gust:
+                specs.append(("rafales_max_km_h", "wind_gust"))
+            specs.append(("wind_direction_deg", "wind_dir"))
+        # Drop unwanted columns
+        elif head != "Temps":
+            name = "date" if j == 0 else COLUMNS_NAMES.get(head, head)
+            specs.append((name, j if j < vent_i else j + 1))
+
+    # Columns of the table, short rows are filled with None
+    columns = {}
+    for name, cell in specs:
+        if wanted is not None and name not in wanted:
+            continue
+
+        if cell == "wind_dir":
+            # Getting wind direction data from the popover
+            columns[name] = []
+            for cells in rows:
+                try:
+                    wind_dir = get_wind_dir(cells[vent_i].div.img.attrs["onmouseover"])
+                    columns[name].append(float(wind_dir))
+                except:
+                    # Some dates don't have the wind direction
+                    columns[name].append(NAN)
+
+        elif cell == "wind_mean" and gust:
+            vents = [cells[vent_i + 1].text for cells in rows]
+            columns[name] = [
                 float(
-                    find_numbers_in_string(
-                        row_data[vent_i + 1][row_data[vent_i + 1].find("(") + 1 : -1]
-                    )
-                    if row_data[vent_i + 1].find("(") != -1
-                    else np.nan
+                    find_numbers_in_string(vent[: vent.find("(") - 2])
+                    if vent.find("/") != -1
+                    else NAN
                 )
-                # row_data[vent_i + 1][row_data[vent_i + 1].find("(") + 1 : -1]
-                for row_data in rows_data
+                for vent in vents
             ]
-            # vent_dir = header.find_next_siblings()[vent_i]
-
-            for i in range(len(rows_data)):
-                rows_data[i][vent_i] = vent_moyens[i]
-                rows_data[i][vent_i + 1] = rafales_max[i]
-                rows_data[i][vent_i] = vent_moyens[i]
-                # Inserting the wind direction data in each row
-                rows_data[i] = (
-                    rows_data[i][: vent_i + 2]
-                    + [wind_dirs[i]]
-                    + rows_data[i][vent_i + 2 :]
-                )
 
-        else:
-            # 1 data in the same field: Vent Moyen, concatenated in the same header (multicolumn header)
-            headers = (
-                headers[0:vent_i]
-                + ["Vent Moyen", "wind_direction_deg"]
-                + headers[vent_i + 1 :]
-            )
-            for i in range(len(rows_data)):
+        elif cell == "wind_mean":
+            columns[name] = []
+            for cells in rows:
                 try:
-                    rows_data[i][vent_i] = float(
-                        find_numbers_in_string((rows_data[i][vent_i + 1]))
+                    columns[name].append(
+                        float(find_numbers_in_string(cells[vent_i + 1].text))
                     )
                 except:
-                    rows_data[i][vent_i] = np.nan
-                rows_data[i][vent_i + 1] = wind_dirs[i]
-
-        df = pd.DataFrame(rows_data, columns=headers)
-
-        # Drop unwanted rows
-        if "Temps" in df.columns:
-            df.drop("Temps", axis="columns", inplace=True)
-
-        # Adjust time data to unique format with date
-        date_format = "%Y-%m-%d %H:%M:%S"
-        date_col = df.columns[0]
-        df[date_col] = df[date_col].apply(
-            lambda x: (
-                datetime.strptime(
-                    (date + " " + x.replace("h", ":").replace(" ", "") + ":00"),
-                    date_format,
-                )
-                if x[-1] != "h"
-                else datetime.strptime(
-                    (date + " " + x.replace("h", ":00").replace(" ", "") + ":00"),
-                    date_format,
+                    columns[name].append(NAN)
+
+        elif cell == "wind_gust":
+            vents = [cells[vent_i + 1].text for cells in rows]
+            columns[name] = [
+                float(
+                    find_numbers_in_string(vent[vent.find("(") + 1 : -1])
+                    if vent.find("(") != -1
+                    else NAN
                 )
-            )
-        )
+                for vent in vents
+            ]
 
-        # Adjusting df columns names
-        df.rename(
-            columns={
-                date_col: "date",
-                "Néb.": "nebulosity_octas",
-                "Temps": "temps",
-                "Visi": "visibility_km",
-                "Température": "temp_degC",
-                "Humi.": "humidity_%",
-                "Point de rosée": "pt_rosee_degC",
-                "Humidex": "humidex",
-                "Windchill": "windchill",
-                "Vent Moyen": "mean_wind_speed_km_h",
-                "Rafales Max": "rafales_max_km_h",
-                "Pression": "pression_hPa",
-                "Précip. mm/h": "precipitation_mm",
-                "Max rain rate": "max_rain_rate_mm_h",
-            },
-            inplace=True,
-        )
+        else:
+            columns[name] = [
+                cells[cell].text if cell < len(cells) else None for cells in rows
+            ]
 
-        # Adjusting data values
-        def get_precipitation(x):
-            if "aucune" in x:
-                return 0.0
-            elif "m" in x:
-                height = float(find_numbers_in_string(x[: x.find("m")]))
-                try:
-                    time = float(find_numbers_in_string(x[x.find("(") : x.find(")")]))
-                except:
-                    time = 1
-                return height
-                # Implementing rate == height/time is not consistent with some tables from meteociel
-                return height / time
-                # return round(height / time, 2)
-            else:
-                return np.nan
+    # Adjusting data values
+    columns["date"] = [get_table_datetime(x, date) for x in columns["date"]]
 
+    if "nebulosity_octas" in columns:
         try:
-            df["nebulosity_octas"] = df["nebulosity_octas"].apply(
-                lambda x: (
-                    float(x[0 : x.find("/")])
-                    if (
-                        x != " "
-                        and x != ""
-                        and x != "\xa0"
-                        and x != "\xa0 "
-                        and x != "&nbsp"
-                    )
-                    else np.nan
-                )
-            )
+            columns["nebulosity_octas"] = [
+                float(x[0 : x.find("/")]) if x not in EMPTY_CELLS else NAN
+                for x in columns["nebulosity_octas"]
+            ]
         except:
             pass
 
+    if "precipitation_mm" in columns:
         try:
-            df["precipitation_mm"] = df["precipitation_mm"].apply(
-                lambda x: get_precipitation(x)
-            )
+            columns["precipitation_mm"] = [
+                get_precipitation(x) for x in columns["precipitation_mm"]
+            ]
         except:
             pass
 
-        problem_cols = []
-        for col in df.columns:
-            if col not in [
-                "date",
-                "nebulosity_octas",
-                "precipitation_mm",
-                "wind_direction_deg",
-                "mean_wind_speed_km_h",
-                "rafales_max_km_h",
-            ]:
-                try:
-                    df[col] = df[col].apply(
-                        lambda x: (
-                            float(find_numbers_in_string(x))
-                            if (
-                                x != " "
-                                and x != ""
-                                and x != "\xa0"
-                                and x != "\xa0 "
-                                and x != "&nbsp"
-                            )
-                            else np.nan
-                        )
-                    )
-                except Exception as e:
-                    problem_cols.append((col, e))
+    problem_cols = []
+    for col, values in columns.items():
+        if col not in [
+            "date",
+            "nebulosity_octas",
+            "precipitation_mm",
+            "wind_direction_deg",
+            "mean_wind_speed_km_h",
+            "rafales_max_km_h",
+        ]:
+            try:
+                columns[col] = [
+                    float(find_numbers_in_string(x)) if x not in EMPTY_CELLS else NAN
+                    for x in values
+                ]
+            except Exception as e:
+                problem_cols.append((col, e))
+
+    if problem_cols != []:
+        print("*********************************************")
+        print("url: ", url)
+        print("problem_cols:", problem_cols)
+        print("*********************************************")
+
+    # Sorting date/hour in ascending
+    order = sorted(range(len(rows)), key=columns["date"].__getitem__)
+    return {col: [values[i] for i in order] for col, values in columns.items()}
+
+
+def scrape_meteociel_page(url, date, columns=None):
+    soup = get_meteociel_page(url)
+    try:
+        # Getting table element
+        table = soup.find("table", bgcolor="#EBFAF7")
+        if table is None:
+            # Only an observation page (with its date selector) without table means no data,
+            # other pages (anti-bot, maintenance...) must not be taken for empty days.
+            if soup.find(attrs={"name": "jour2"}) is None:
+                raise ValueError(
+                    f"Unexpected page (no data table nor date selector) {url}"
+                )
+            # Data not avaiable, returns empty columns.
+            # Ex URL: set one avaiable to a future date.
+            print("No data table in ", url)
+            return {}
+
+        return parse_meteociel_table(table, date, url, columns)
+    finally:
+        # The bs4 tree is full of reference cycles, freeing it now keeps long runs from
+        # piling up pages until the garbage collector passes.
+        soup.decompose()
+
+
+def get_meteociel_columns(date, meteostation, url="", use_cache=True, columns=None):
+    """
+    Scrapes one meteociel page into plain python lists.
+    Concurrent requests for the same page share one fetch and parse (see meteociel_flight),
+    use_cache=False skips the recent results and fetches the page again.
+    columns: list of the output columns to extract (see parse_meteociel_table), optional.
+    Output: dict {column name: list of values}, the date and station of the page.
+    """
+    # Building the url if it was not given
+    if url:
+        date, meteostation = get_info_from_url(url)
+
+    # Canonical url, so "jour2=1" and "jour2=01" are the same page
+    url = build_meteociel_url(date, meteostation)
+    key = (url, None if columns is None else tuple(sorted(set(columns))))
+
+    table_data = meteociel_flight.do(
+        key, lambda: scrape_meteociel_page(url, date, columns), use_cache
+    )
+
+    # The cached lists are shared, callers get their own copies
+    return (
+        {col: list(values) for col, values in table_data.items()},
+        date,
+        meteostation,
+    )
+
+
+def get_records_from_columns(table_data):
+    """
+    Input: dict {column name: list of values} of a page (see get_meteociel_columns).
+    Output: list of MeteocielRecord, the missing columns are nan.
+    """
+    fields = [
+        (RECORD_FIELDS[col], values)
+        for col, values in table_data.items()
+        if col in RECORD_FIELDS
+    ]
+    return [
+        MeteocielRecord(**{field: values[i] for field, values in fields})
+        for i in range(len(table_data.get("date", [])))
+    ]
+
+
+def get_meteociel_records(
+    date="2023-01-01",
+    meteostation="7157",
+    url="",
+    as_columns=False,
+    use_cache=True,
+    columns=None,
+):
+    """
+    Lightweight version of get_meteociel_data, pandas and numpy are not imported.
+    Inputs:
+        date: [yyyy-mm-dd] string format, optional.
+        meteostation: number of station, integer or string format, optional.
+        url: If given will ignore date and station, optional.
+        as_columns: If True returns a dict {column name: list of values} with
+            every column of the page instead of records, optional.
+        use_cache: If False the page is fetched again instead of reusing a recent result, optional.
+        columns: list of the columns to extract (eg. ["temp_degC", "pression_hPa"]), the
+            others are not parsed and are nan in the records, optional.
+    Output:
+        list of MeteocielRecord (namedtuple) sorted by date, or the columns dict.
+    """
+    try:
+        table_data, _, _ = get_meteociel_columns(
+            date, meteostation, url, use_cache, columns
+        )
+    except Exception as e:
+        print("******")
+        print("Error in scraping ", url or date)
+        print(e)
+        print("******")
+        table_data = {}
 
-        if problem_cols != []:
-            print("*********************************************")
-            print("url: ", url)
-            print("problem_cols:", problem_cols)
-            print("*********************************************")
+    if as_columns:
+        return table_data
 
-        # Sorting date/hour in ascending
-        df.sort_values("date", ascending=True, inplace=True)
+    return get_records_from_columns(table_data)
+
+
+def get_meteociel_data(
+    date="2023-01-01",
+    meteostation="7157",
+    url="",
+    csv_export=False,
+    filepath="files/meteo_tables/meteociel_scraping/",
+    columns=None,
+):
+    """
+    Inputs:
+        date: [yyyy-mm-dd] string format, optional.
+        meteostation: number of station, integer or string format, optional.
+        url: If given will ignore date and station, optional.
+        columns: list of the columns to extract (eg. ["temp_degC", "mean_wind_speed_km_h", "pression_hPa"]),
+            the other cells of the table are not parsed. "date" is always returned, optional.
+    Output:
+        df with meteociel data for the given date and station.
+    """
+    import pandas as pd
+
+    try:
+        table_data, date, meteostation = get_meteociel_columns(
+            date, meteostation, url, columns=columns
+        )
+        if not table_data:
+            return pd.DataFrame({}), ""
+
+        df = pd.DataFrame(table_data)
 
         # Exporting to csv if desired
         if csv_export == True:
@@ -355,12 +508,111 @@ def get_meteociel_data(
             return df, ""
     except Exception as e:
         print("******")
-        print("Error in scraping ", url)
+        print("Error in scraping ", url or date)
         print(e)
         print("******")
         return pd.DataFrame({}), ""
 
 
+def fetch_meteociel_day(date, meteostation, use_cache=True, columns=None):
+    """
+    Scrapes one station-day for get_historic_meteociel.
+    Output: dict {column name: list of values} and the status of the day:
+        "ok", "empty" (observation page loaded without data or with an empty table)
+        or "error" (request refused or failed, unexpected page, parsing failed).
+    """
+    try:
+        table_data, _, _ = get_meteociel_columns(
+            date, meteostation, use_cache=use_cache, columns=columns
+        )
+    except Exception as e:
+        print("******")
+        print("Error in scraping ", meteostation, date)
+        print(e)
+        print("******")
+        return {}, "error"
+
+    return table_data, "ok" if table_data else "empty"
+
+
+def get_day_completeness(date, local_dates, timezone="Europe/Paris"):
+    """
+    Inputs:
+        date: [yyyy-mm-dd] string format, local day of the page.
+        local_dates: datetimes (local time) observed in that day.
+        timezone: timezone of the page.
+    Output: expected hours, present hours and list of the missing hours of the day.
+        Hours that don't exist in the local day (DST transition) are not expected.
+    """
+    tz = ZoneInfo(timezone)
+    day = datetime.strptime(date, "%Y-%m-%d")
+    expected = []
+    for hour in range(24):
+        local = day.replace(hour=hour, tzinfo=tz)
+        # Nonexistent local hours don't come back with the same wall time
+        if local.astimezone(dt_timezone.utc).astimezone(tz).hour == hour:
+            expected.append(hour)
+
+    observed = {d.hour for d in local_dates if d.strftime("%Y-%m-%d") == date}
+    missing = [hour for hour in expected if hour not in observed]
+    return len(expected), len(expected) - len(missing), missing
+
+
+def load_empty_days(empty_days_path):
+    """
+    Output: dict {station: set of dates} of station-days known to have no data.
+    """
+    try:
+        with open(empty_days_path) as f:
+            return {station: set(days) for station, days in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def save_empty_days(empty_days, empty_days_path):
+    # Writing to a temporary file first, so a crash or a concurrent run never leaves a truncated json
+    os.makedirs(os.path.dirname(empty_days_path) or ".", exist_ok=True)
+    tmp_path = f"{empty_days_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({station: sorted(days) for station, days in empty_days.items()}, f)
+    os.replace(tmp_path, empty_days_path)
+
+
+def localize_meteociel_frame(df, start_date, end_date, timezone="Europe/Paris"):
+    """
+    Converts the local "date" column of scraped tables to "date_UTC" and keeps
+    only the rows between start_date and end_date (UTC). Works on any chunk of days.
+    """
+    import pandas as pd
+
+    # Creating a "date_local" column
+    df["date_local"] = df["date"]
+
+    # Converting the "date" column to UTC
+    df["date"] = (
+        pd.to_datetime(df["date"])
+        .dt.tz_localize(timezone, nonexistent="NaT", ambiguous="NaT")
+        .dt.tz_convert(timezone)
+    )
+
+    # Dropping inexistent UTC dates (daytime transitions at last sunday in march and october for Paris)
+    df.dropna(subset=["date"], inplace=True, axis="index")
+    df["date"] = df["date"].dt.tz_convert("UTC").dt.strftime("%Y-%m-%d %H:%M:%S")
+    df.rename(columns={"date": "date_UTC"}, inplace=True)
+
+    # Selecting data only between the provided start_date and end_date (UTC)
+    return df[
+        (df["date_UTC"] >= start_date)
+        & (
+            df["date_UTC"]
+            < datetime.strftime(
+                datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1),
+                format="%Y-%m-%d",
+            )
+        )
+    ]
+
+
 def get_historic_meteociel(
     start_date,
     end_date,
@@ -368,74 +620,277 @@ def get_historic_meteociel(
     timezone="Europe/Paris",
     csv_export=False,
     filepath="files/meteo_tables/meteociel_scraping/",
+    refetch_incomplete=0,
+    negative_cache=False,
+    empty_days_path="files/meteo_tables/meteociel_scraping/empty_days.json",
+    report=False,
+    max_memory_mb=None,
+    spill_dir=None,
+    binary_export=False,
+    columns=None,
 ):
     """
     Input: start_date: [yyyy-mm-dd] string format
            end_date: [yyyy-mm-dd] string format
            meteostation: string or integer with the number of the station
            timezone: timezone for the data (eg. "Europe/Paris"), to further convert to UTC.
+           refetch_incomplete: number of extra passes requesting again only the past days with missing hours or errors.
+           negative_cache: If True the station-days without data are saved in empty_days_path and skipped in later runs.
+           report: If True also returns the completeness report (one row per day).
+           max_memory_mb: If given, the scraped days are converted and filtered in chunks of about this size
+               and spilled to a temporary columnar folder (in spill_dir), for very long ranges.
+               With csv_export or binary_export the export is written chunk by chunk and the returned df is empty.
+           columns: list of the columns to extract (eg. ["temp_degC", "pression_hPa"]), the other cells
+               are not parsed. "date_UTC" and "date_local" are always returned.
+           binary_export: If True writes a folder with one .npy file per column and a meta.json header
+               (memory-mappable, see get_meteo.binary_export.load_binary_export), in filepath.
+               date_UTC and date_local are saved as float64 seconds since 1970-01-01 (wall-clock).
     Output: df with data from meteociel ranging from start_date to end_date
+            path with the filepath of the csv_export if set to True, of the binary_export folder if set to True
+                (returned over the csv one if both are set) or ""
+            report df with station, date, status, expected_hours, present_hours, missing_hours and attempts (only if report=True)
     """
+    import pandas as pd
 
     if end_date < start_date:
         raise ValueError("end_date must be bigger or equal than start_date")
 
+    meteostation = str(meteostation)
     dates = get_ranges_of_dates(start_date, end_date)
-    ret_df = pd.DataFrame({})
-
-    for date in dates:
-        df, _ = get_meteociel_data(date, meteostation, csv_export=False)
-        ret_df = pd.concat([ret_df, df], axis="rows")
+    today = datetime.now(ZoneInfo(timezone)).strftime("%Y-%m-%d")
+    max_bytes = max_memory_mb * 1024**2 if max_memory_mb else float("inf")
 
-    # Creating a "date_local" column
-    ret_df["date_local"] = ret_df["date"]
-
-    # Converting the "date" column to UTC
-    ret_df["date"] = (
-        pd.to_datetime(ret_df["date"])
-        .dt.tz_localize(timezone, nonexistent="NaT", ambiguous="NaT")
-        .dt.tz_convert(timezone)
-    )
+    empty_days = load_empty_days(empty_days_path) if negative_cache else {}
+    known_empty = empty_days.get(meteostation, set())
 
-    # Dropping inexistent UTC dates (daytime transitions at last sunday in march and october for Paris)
-    ret_df.dropna(subset=["date"], inplace=True, axis="index")
-    ret_df["date"] = (
-        ret_df["date"]
-        .dt.tz_convert("UTC")
-        .apply(lambda x: datetime.strftime(x, format="%Y-%m-%d %H:%M:%S"))
-    )
-    ret_df.rename(columns={"date": "date_UTC"}, inplace=True)
+    days = {}
+    chunks = []
+    spill = tempfile.TemporaryDirectory(dir=spill_dir) if max_memory_mb else None
+    # The spill folder is removed whatever happens, it may hold years of data
+    try:
+        if spill is not None or binary_export:
+            from get_meteo.binary_export import binary_export_df, binary_export_chunks
+            from get_meteo.binary_export import read_meta, load_binary_export_df
+
+        def flush(chunk_dates):
+            # Requesting again only the past days with gaps, keeping the most complete table
+            for _ in range(refetch_incomplete):
+                incomplete = [
+                    date
+                    for date in chunk_dates
+                    if date < today
+                    and days[date]["status"] in ("ok", "error")
+                    and days[date]["present_hours"] < days[date]["expected_hours"]
+                ]
+                if not incomplete:
+                    break
+                for date in incomplete:
+                    day = days[date]
+                    table_data, status = fetch_meteociel_day(
+                        date, meteostation, use_cache=False, columns=columns
+                    )
+                    day["attempts"] += 1
+                    expected, present, missing = get_day_completeness(
+                        date, table_data.get("date", []), timezone
+                    )
+                    # A day that failed before can turn out empty, it is then negative cached as such
+                    if (status == "ok" and present > day["present_hours"]) or (
+                        status == "empty" and day["status"] == "error"
+                    ):
+                        day.update(
+                            table_data=table_data,
+                            status=status,
+                            present_hours=present,
+                            missing_hours=missing,
+                        )
 
-    # Selecting data only between the provided start_date and end_date (UTC)
-    ret_df = ret_df[
-        (ret_df["date_UTC"] >= start_date)
-        & (
-            ret_df["date_UTC"]
-            < datetime.strftime(
-                datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1),
-                format="%Y-%m-%d",
+            # The day tables become dataframes only here, one small frame per day costs far more than its data
+            frames = [
+                pd.DataFrame(table_data)
+                for table_data in [days[date].pop("table_data") for date in chunk_dates]
+                if table_data
+            ]
+            if not frames:
+                return
+            chunk = localize_meteociel_frame(
+                pd.concat(frames, axis="rows"), start_date, end_date, timezone
             )
+            if spill is None:
+                chunks.append(chunk)
+            elif len(chunk):
+                chunk_dir = os.path.join(spill.name, str(len(chunks)).zfill(6))
+                binary_export_df(chunk, chunk_dir)
+                chunks.append(chunk_dir)
+
+        chunk_dates = []
+        chunk_bytes = 0
+        for date in dates:
+            if date in known_empty:
+                table_data, status = {}, "cached_empty"
+            else:
+                table_data, status = fetch_meteociel_day(
+                    date, meteostation, columns=columns
+                )
+            expected, present, missing = get_day_completeness(
+                date, table_data.get("date", []), timezone
+            )
+            days[date] = {
+                "table_data": table_data,
+                "status": status,
+                "expected_hours": expected,
+                "present_hours": present,
+                "missing_hours": missing,
+                "attempts": int(status != "cached_empty"),
+            }
+            chunk_dates.append(date)
+            chunk_bytes += CELL_BYTES * sum(
+                len(values) for values in table_data.values()
+            )
+            if chunk_bytes >= max_bytes:
+                flush(chunk_dates)
+                chunk_dates = []
+                chunk_bytes = 0
+        flush(chunk_dates)
+
+        if negative_cache:
+            min_age = (
+                datetime.strptime(today, "%Y-%m-%d")
+                - timedelta(days=NEGATIVE_CACHE_MIN_AGE_DAYS)
+            ).strftime("%Y-%m-%d")
+            new_empty = {
+                date
+                for date, day in days.items()
+                if day["status"] == "empty" and date <= min_age
+            }
+            if new_empty:
+                empty_days[meteostation] = known_empty | new_empty
+                save_empty_days(empty_days, empty_days_path)
+
+        report_df = pd.DataFrame(
+            [
+                {
+                    "station": meteostation,
+                    "date": date,
+                    "status": day["status"],
+                    "expected_hours": day["expected_hours"],
+                    "present_hours": day["present_hours"],
+                    "missing_hours": day["missing_hours"],
+                    "attempts": day["attempts"],
+                }
+                for date, day in days.items()
+            ]
         )
-    ]
 
-    ret_df.reset_index(inplace=True, drop=True)
+        filename = f"{meteostation}_{start_date}--{end_date}.csv"
+        binary_dirname = f"{meteostation}_{start_date}--{end_date}_npy"
+        metadata = {
+            "station": meteostation,
+            "start_date": start_date,
+            "end_date": end_date,
+            "timezone": timezone,
+        }
+        time_columns = {"date_UTC": "UTC", "date_local": timezone}
+        path = ""
+
+        if spill is None:
+            ret_df = pd.concat([pd.DataFrame({})] + chunks, axis="rows")
+            ret_df.reset_index(inplace=True, drop=True)
+
+            if csv_export == True:
+                try:
+                    os.makedirs(filepath, exist_ok=True)
+                    ret_df.to_csv(filepath + filename, index=False)
+                except Exception as e:
+                    print("******")
+                    print(
+                        "Error in the csv export path, see if atleast a df was returned."
+                    )
+                    print("current directory: ", os.getcwd())
+                    print(e)
+                    print("******")
+                path = filepath + filename
 
-    if csv_export == True:
-        try:
-            filename = f"{meteostation}_{start_date}--{end_date}.csv"
-            os.makedirs(filepath, exist_ok=True)
-            ret_df.to_csv(filepath + filename, index=False)
-        except Exception as e:
-            print("******")
-            print("Error in the csv export path, see if atleast a df was returned.")
-            print("current directory: ", os.getcwd())
-            print(e)
-            print("******")
-
-        return ret_df, filepath + filename
+            if binary_export == True:
+                try:
+                    binary_export_df(
+                        ret_df, filepath + binary_dirname, metadata, time_columns
+                    )
+                except Exception as e:
+                    print("******")
+                    print(
+                        "Error in the binary export path, see if atleast a df was returned."
+                    )
+                    print("current directory: ", os.getcwd())
+                    print(e)
+                    print("******")
+                path = filepath + binary_dirname
 
-    else:
-        return ret_df, ""
+        else:
+            # Streaming the spilled chunks, stations may add columns along the years
+            export_columns = []
+            for chunk_dir in chunks:
+                export_columns += [
+                    col["name"]
+                    for col in read_meta(chunk_dir)["columns"]
+                    if col["name"] not in export_columns
+                ]
+
+            if csv_export == True:
+                try:
+                    os.makedirs(filepath, exist_ok=True)
+                    pd.DataFrame(columns=export_columns).to_csv(
+                        filepath + filename, index=False
+                    )
+                    for chunk_dir in chunks:
+                        load_binary_export_df(chunk_dir).reindex(
+                            columns=export_columns
+                        ).to_csv(
+                            filepath + filename, mode="a", header=False, index=False
+                        )
+                except Exception as e:
+                    print("******")
+                    print(
+                        "Error in the csv export path, see if atleast a df was returned."
+                    )
+                    print("current directory: ", os.getcwd())
+                    print(e)
+                    print("******")
+                path = filepath + filename
+
+            if binary_export == True:
+                try:
+                    binary_export_chunks(
+                        chunks, filepath + binary_dirname, metadata, time_columns
+                    )
+                except Exception as e:
+                    print("******")
+                    print(
+                        "Error in the binary export path, see if atleast a df was returned."
+                    )
+                    print("current directory: ", os.getcwd())
+                    print(e)
+                    print("******")
+                path = filepath + binary_dirname
+
+            if csv_export == True or binary_export == True:
+                ret_df = pd.DataFrame({})
+            else:
+                ret_df = (
+                    pd.concat(
+                        [load_binary_export_df(chunk_dir) for chunk_dir in chunks],
+                        axis="rows",
+                        ignore_index=True,
+                    ).reindex(columns=export_columns)
+                    if chunks
+                    else pd.DataFrame({})
+                )
+    finally:
+        if spill is not None:
+            spill.cleanup()
+
+    if report:
+        return ret_df, path, report_df
+    return ret_df, path
 
 
 if __name__ == "__main__":
@@ -6,6 +6,8 @@ from datetime import datetime, timedelta
 import numpy as np
 import os
 
+from get_meteo.single_flight import SingleFlight
+
 
 def get_info_from_prevision_url(url):
     prevision = url.split(".")[2].split("/")[1]
@@ -25,6 +27,94 @@ def find_numbers_in_string(input_string):
     return numbers_as_string
 
 
+# Shared by the threads of the process: identical page requests are fetched and parsed once.
+prevision_flight = SingleFlight(maxsize=128, ttl=30)
+
+# Output names of the prevision table columns, after "Jour" and "Heure".
+PREVISION_COLUMNS = [
+    "temp_degC",
+    "windchill",
+    "wind_direction_deg",
+    "mean_wind_speed_km_h",
+    "rafales_max_km_h",
+    "precipitation_mm",
+    "humidity_%",
+    "pression_hPa",
+    "temps",
+]
+
+# Cells considered as "no data" in the prevision tables.
+EMPTY_CELLS = (" ", "", "\xa0", "\xa0 ", "&nbsp")
+
+NUMBERS_PATTERN = r"-?\d+\.\d+|-?\d+"
+
+# Nebulosity (octas) of the "temps" images, the first pattern found in the image name is used.
+NEB_FROM_IMG = [
+    ("Averses de pluie faibles", 7.0),
+    ("soleil.gif", 0.0),
+    ("voile.png", 2.0),
+    ("peu_nuageu", 3.0),
+    ("mitige.gif", 4.0),
+    ("pluie.gif", 7.0),
+    ("grele.gif", 7.0),
+    ("neige.gif", 8.0),
+    ("oragefaibl", 7.0),
+    ("brouillard", 8.0),
+    ("pluie_neig", 8.0),
+    ("nuageux.gi", 8.0),
+]
+
+
+def get_numbers_from_column(col, empty_cells=EMPTY_CELLS):
+    """
+    Vectorized find_numbers_in_string over a column of strings.
+    Empty cells are nan, raises ValueError if a cell has no number.
+    Always float64 (as float() cell by cell), even when the column has only integers.
+    """
+    numbers = col.str.findall(NUMBERS_PATTERN).str.join("")
+    return pd.to_numeric(numbers.mask(col.isin(empty_cells)), errors="raise").astype(
+        float
+    )
+
+
+def get_neb_from_img(imgs):
+    """
+    Input: column with the names of the "temps" images.
+    Output: array with the nebulosity in octas, nan if the image is not known.
+    """
+    conditions = [
+        imgs.str.contains(pattern, regex=False, na=False) for pattern, _ in NEB_FROM_IMG
+    ]
+    return np.select(conditions, [neb for _, neb in NEB_FROM_IMG], default=np.nan)
+
+
+def resolve_table_day(day, ref_date):
+    """
+    Inputs:
+        day: day of the month shown in the prevision table.
+        ref_date: [yyyy-mm-dd] string format, date of the prevision page.
+    Output: [yyyy-mm-dd] date closest to ref_date with that day, in the same, next or previous month.
+    """
+    # OBS: Sometimes the date in the table in the right is not the date in the first row of the data table.
+    # Picking the closest candidate solves this issue and the issue when there`s month transitions`.
+    ref = datetime.strptime(ref_date, "%Y-%m-%d")
+    first = ref.replace(day=1)
+    if day < ref.day:
+        months = [first, first + timedelta(days=32)]
+    else:
+        months = [first, first - timedelta(days=2)]
+
+    candidates = []
+    for month in months:
+        try:
+            candidates.append(month.replace(day=day))
+        except ValueError:
+            # Day doesn't exist in that month
+            pass
+
+    return min(candidates, key=lambda d: abs(ref - d)).strftime("%Y-%m-%d")
+
+
 def get_date_from_prevision(arpege_soup):
     d = (
         arpege_soup.find("table", cellpadding=5)
@@ -73,61 +163,21 @@ def get_date_from_prevision(arpege_soup):
     return formatted_date
 
 
-def get_prevision_data(
-    code="",
-    url="",
-    timezone="Europe/Paris",
-    csv_export=False,
-    prevision="previsions-arpege-1h",
-    filepath="files/meteo_tables/meteo_prev/",
-):
+def scrape_prevision_page(url, timezone="Europe/Paris", columns=None):
     """
-    Inputs:
-        code: number of the local in meteociel, integer or string format, optional
-            To find the code of your desired location go to the url of the predictions and insert the postal-code of the region in the box below the page.
-        url: If given will ignore code, optional
-        timezone: timezone for the data (eg. "Europe/Paris"), to further convert to UTC
-        csv_export: To export the data in csv if set to True
-        prevision is one the options from meteociel: ["previsions","previsions-wrf","previsions-wrf-1h","previsions-arome","previsions-arome-1h","previsions-arpege-1h","previsions-iconeu","previsions-icond2"]
-    Output:
-        df with prediction meteo data for the given station
+    Fetches and parses one prevision page.
+    columns: list of the output columns to extract, the cells of the others are not read, optional.
+    Output: df with the prediction data (empty if the table is not available), raises on scraping errors.
     """
+    wanted = None if columns is None else set(columns)
 
-    # Building the url if it was not given
-    if not url:
-        previsions_list = [
-            "previsions",
-            "previsions-wrf",
-            "previsions-wrf-1h",
-            "previsions-arome",
-            "previsions-arome-1h",
-            "previsions-arpege-1h",
-            "previsions-iconeu",
-            "previsions-icond2",
-        ]
+    # Hosting request
+    r = requests.get(url)
 
-        if prevision not in previsions_list:
-            raise ValueError(f"Prevision must be one of {previsions_list}")
-
-        # Validate the date input and build the url
-        url = f"https://www.meteociel.fr/{prevision}/{code}/neimportepaslaville.htm"
-        # print(url)
-
-        if not code:
-            raise KeyError(
-                "Give the desired station code (found in the URL) for the prevision"
-            )
-
-    else:
-        code, ville, prevision = get_info_from_prevision_url(url)
+    # Parsing html
+    soup = BeautifulSoup(r.text, "lxml")
 
     try:
-        # Hosting request
-        r = requests.get(url)
-
-        # Parsing html
-        soup = BeautifulSoup(r.text, "lxml")
-
         try:
             start_date = get_date_from_prevision(soup)
         except:
@@ -178,68 +228,72 @@ def get_prevision_data(
         except Exception as e:
             # Data not avaiable, returns empty dataframe.
             print(e)
-            return pd.DataFrame({}), ""
+            return pd.DataFrame({})
+
+        # Output names of the columns after Jour and Heure
+        names = dict(zip(header[2:], PREVISION_COLUMNS))
+
+        # Positions in the header of the columns to extract, Jour and Heure are always needed
+        extract = [
+            i
+            for i, head in enumerate(header)
+            if i <= 1 or wanted is None or names.get(head) in wanted
+        ]
+        table_data = {header[i]: [] for i in extract if i != 0}
+        extract = set(extract)
 
-        table_data = {head: [] for head in header}
+        # The "temps" images are only read for the columns using them
+        need_imgs = wanted is None or bool(wanted & {"temps_img", "nebulosity_octas"})
 
         # Getting data
-        jour_hours = []
         jours = []
+        jours_start = []
         imgs = []
-        n_hours = ""
-        for data_row in data_rows:
+        for n_row, data_row in enumerate(data_rows):
             # Appending Temps img
-            try:
-                imgs.append(data_row.find_all("img")[-1].get("src").split("/")[-1])
-            except:
-                imgs.append(np.nan)
+            if need_imgs:
+                try:
+                    imgs.append(data_row.find_all("img")[-1].get("src").split("/")[-1])
+                except:
+                    imgs.append(np.nan)
 
             # Appending the rest of the data
             data = data_row.find_all("td")
             if len(data) == 11:
+                # First row of a day
                 start = 1
-                if n_hours:
-                    jour_hours.append(n_hours)
-                n_hours = 0
-                jour = data[0].text
-                jours.append(jour)
-                n_hours += 1
+                jours.append(data[0].text)
+                jours_start.append(n_row)
             else:
                 start = 0
-                n_hours += 1
             for i in range(start, len(data)):
+                if i - start + 1 not in extract:
+                    continue
                 if data[i].text != "":
                     table_data[header[i - start + 1]].append(data[i].text)
                 else:
                     table_data[header[i - start + 1]].append(data[i].img["alt"])
 
-        jour_hours.append(n_hours)
-
-        for k in range(len(jours)):
-            table_data[header[0]].extend([jours[k]] * jour_hours[k])
+        # Resolving each distinct day once and broadcasting it to the hours of the day
+        jour_hours = np.diff(jours_start + [len(data_rows)])
+        days = {
+            jour: resolve_table_day(int(find_numbers_in_string(jour)), start_date)
+            for jour in set(jours)
+        }
+        table_data[header[0]] = np.repeat([days[jour] for jour in jours], jour_hours)
 
         df = pd.DataFrame(table_data)
 
-        df.rename(
-            columns={
-                header[2]: "temp_degC",
-                header[3]: "windchill",
-                header[4]: "wind_direction_deg",
-                header[5]: "mean_wind_speed_km_h",
-                header[6]: "rafales_max_km_h",
-                header[7]: "precipitation_mm",
-                header[8]: "humidity_%",
-                header[9]: "pression_hPa",
-                header[10]: "temps",
-            },
-            inplace=True,
-        )
+        df.rename(columns=names, inplace=True)
 
-        df["temps_img"] = imgs
+        if need_imgs:
+            df["temps_img"] = imgs
 
-        df["precipitation_mm"] = df["precipitation_mm"].apply(
-            lambda x: float(find_numbers_in_string(x)) if x != "--" else 0.0
-        )
+        if "precipitation_mm" in df.columns:
+            df["precipitation_mm"] = get_numbers_from_column(
+                df["precipitation_mm"].where(df["precipitation_mm"] != "--", "0"),
+                empty_cells=("",),
+            )
 
         get_numbers_cols = [
             "temp_degC",
@@ -252,20 +306,10 @@ def get_prevision_data(
         ]
         problem_cols = []
         for col in get_numbers_cols:
+            if col not in df.columns:
+                continue
             try:
-                df[col] = df[col].apply(
-                    lambda x: (
-                        float(find_numbers_in_string(x))
-                        if (
-                            x != " "
-                            and x != ""
-                            and x != "\xa0"
-                            and x != "\xa0 "
-                            and x != "&nbsp"
-                        )
-                        else np.nan
-                    )
-                )
+                df[col] = get_numbers_from_column(df[col])
             except Exception as e:
                 problem_cols.append((col, e))
         if problem_cols != []:
@@ -273,115 +317,34 @@ def get_prevision_data(
             print(problem_cols)
 
         # Adjust nebulosity_octas from nebulosity_octas_prev (used previous one)
-        def get_neb_from_img(img):
-            if "Averses de pluie faibles" in img:
-                return 7.0
-            if "soleil.gif" in img:
-                return 0.0
-            if "voile.png" in img:
-                return 2.0
-            if "peu_nuageu" in img:
-                return 3.0
-            if "mitige.gif" in img:
-                return 4.0
-            if "pluie.gif" in img:
-                return 7.0
-            if "grele.gif" in img:
-                return 7.0
-            if "neige.gif" in img:
-                return 8.0
-            if "oragefaibl" in img:
-                return 7.0
-            if "brouillard" in img:
-                return 8.0
-            if "pluie_neig" in img:
-                return 8.0
-            if "nuageux.gi" in img:
-                return 8.0
-            else:
-                return np.nan
-
-        df["nebulosity_octas"] = df["temps_img"].apply(lambda x: get_neb_from_img(x))
-
-        def get_nth_day_next_month(ref_date, n):
-            # Convert the input string to a datetime object
-            input_date = datetime.strptime(ref_date, "%Y-%m-%d")
-
-            # Calculate the nth day of the next month
-            nth_day_of_next_month = (
-                input_date.replace(day=1) + timedelta(days=32)
-            ).replace(day=n)
-
-            # Convert the result back to the desired format
-            result_date_str = nth_day_of_next_month.strftime("%Y-%m-%d")
-            return result_date_str
-
-        def get_nth_day_prev_month(ref_date, n):
-            # Convert the input string to a datetime object
-            input_date = datetime.strptime(ref_date, "%Y-%m-%d")
-
-            # Calculate the nth day of the prev month
-            nth_day_of_prev_month = (
-                input_date.replace(day=1) - timedelta(days=2)
-            ).replace(day=n)
-
-            # Convert the result back to the desired format
-            result_date_str = nth_day_of_prev_month.strftime("%Y-%m-%d")
-            return result_date_str
-
-        def get_table_date(x, ref_date):
-            # OBS: Sometimes the date in the table in the right is not the date in the first row of the data table.
-            # The if-else clause below solves this issue and the issue when there`s month transitions`.
-            ref_datetime = datetime.strptime(ref_date, "%Y-%m-%d")
-            ref_day = ref_datetime.day
-            if int(x) < ref_day:
-                dates = [
-                    datetime.strftime(ref_datetime.replace(day=int(x)), "%Y-%m-%d"),
-                    get_nth_day_next_month(ref_date, int(x)),
-                ]
-                # Get closest date
-                return min(
-                    dates,
-                    key=lambda date: abs(
-                        ref_datetime - datetime.strptime(date, "%Y-%m-%d")
-                    ),
-                )
-            else:
-                dates = [
-                    datetime.strftime(ref_datetime.replace(day=int(x)), "%Y-%m-%d"),
-                    get_nth_day_prev_month(ref_date, int(x)),
-                ]
-                # Get closest date
-                return min(
-                    dates,
-                    key=lambda date: abs(
-                        ref_datetime - datetime.strptime(date, "%Y-%m-%d")
-                    ),
-                )
-
-        df["Jour"] = df["Jour"].apply(
-            lambda x: get_table_date(find_numbers_in_string(x), start_date)
-        )
+        if need_imgs:
+            df["nebulosity_octas"] = get_neb_from_img(df["temps_img"])
 
         # Converting date column to date-time column.
         df["date"] = df["Jour"] + " " + df["Heure"] + ":00"
         df.drop(["Jour", "Heure"], axis="columns", inplace=True)
 
+        output_cols = [
+            "date",  #
+            "temp_degC",  #
+            "windchill",
+            "wind_direction_deg",  #
+            "mean_wind_speed_km_h",  #
+            "rafales_max_km_h",
+            "precipitation_mm",  #
+            "humidity_%",  #
+            "pression_hPa",  #
+            "temps",
+            "temps_img",
+            "nebulosity_octas",  #
+            # visibility_km (marked the ones necessary for the meteo.txt TELEMAC)
+        ]
         df = df[
             [
-                "date",  #
-                "temp_degC",  #
-                "windchill",
-                "wind_direction_deg",  #
-                "mean_wind_speed_km_h",  #
-                "rafales_max_km_h",
-                "precipitation_mm",  #
-                "humidity_%",  #
-                "pression_hPa",  #
-                "temps",
-                "temps_img",
-                "nebulosity_octas",  #
-                # visibility_km (marked the ones necessary for the meteo.txt TELEMAC)
+                col
+                for col in output_cols
+                if col == "date"
+                or (col in df.columns and (wanted is None or col in wanted))
             ]
         ]
 
@@ -390,13 +353,84 @@ def get_prevision_data(
 
         # Converting the "date" column to UTC
         df["date"] = pd.to_datetime(df["date"]).dt.tz_localize(timezone)
-        df["date"] = (
-            df["date"]
-            .dt.tz_convert("UTC")
-            .apply(lambda x: datetime.strftime(x, format="%Y-%m-%d %H:%M:%S"))
-        )
+        df["date"] = df["date"].dt.tz_convert("UTC").dt.strftime("%Y-%m-%d %H:%M:%S")
         df.rename(columns={"date": "date_UTC"}, inplace=True)
 
+        return df
+    finally:
+        # The bs4 tree is full of reference cycles, freeing it now keeps long runs from
+        # piling up pages until the garbage collector passes.
+        soup.decompose()
+
+
+def get_prevision_data(
+    code="",
+    url="",
+    timezone="Europe/Paris",
+    csv_export=False,
+    prevision="previsions-arpege-1h",
+    filepath="files/meteo_tables/meteo_prev/",
+    binary_export=False,
+    columns=None,
+):
+    """
+    Inputs:
+        code: number of the local in meteociel, integer or string format, optional
+            To find the code of your desired location go to the url of the predictions and insert the postal-code of the region in the box below the page.
+        url: If given will ignore code, optional
+        timezone: timezone for the data (eg. "Europe/Paris"), to further convert to UTC
+        csv_export: To export the data in csv if set to True
+        binary_export: To export the data as a folder of memory-mappable .npy columns plus a meta.json header if set to True
+            (see get_meteo.binary_export.load_binary_export), its path is returned over the csv one if both are set
+        columns: list of the columns to extract (eg. ["temp_degC", "mean_wind_speed_km_h", "pression_hPa"]),
+            the other cells are not parsed and the weather icons are only decoded for "temps_img"/"nebulosity_octas".
+            "date_UTC" and "date_local" are always returned, optional
+        prevision is one the options from meteociel: ["previsions","previsions-wrf","previsions-wrf-1h","previsions-arome","previsions-arome-1h","previsions-arpege-1h","previsions-iconeu","previsions-icond2"]
+    Output:
+        df with prediction meteo data for the given station
+    """
+
+    # Building the url if it was not given
+    if not url:
+        previsions_list = [
+            "previsions",
+            "previsions-wrf",
+            "previsions-wrf-1h",
+            "previsions-arome",
+            "previsions-arome-1h",
+            "previsions-arpege-1h",
+            "previsions-iconeu",
+            "previsions-icond2",
+        ]
+
+        if prevision not in previsions_list:
+            raise ValueError(f"Prevision must be one of {previsions_list}")
+
+        # Validate the date input and build the url
+        url = f"https://www.meteociel.fr/{prevision}/{code}/neimportepaslaville.htm"
+        # print(url)
+
+        if not code:
+            raise KeyError(
+                "Give the desired station code (found in the URL) for the prevision"
+            )
+
+    else:
+        code, ville, prevision = get_info_from_prevision_url(url)
+
+    # Canonical url, the ville in the url doesn't change the page
+    url = f"https://www.meteociel.fr/{prevision}/{code}/neimportepaslaville.htm"
+
+    try:
+        # Concurrent requests for the same page share one fetch and parse
+        key = (url, timezone, None if columns is None else tuple(sorted(set(columns))))
+        df = prevision_flight.do(
+            key, lambda: scrape_prevision_page(url, timezone, columns)
+        ).copy()
+        if df.empty:
+            return df, ""
+
+        path = ""
         if csv_export == True:
             filename = f"{code}_{prevision}_{df['date_UTC'].iloc[0].replace(' ', '_')[0:13]}h.csv"
             os.makedirs(filepath, exist_ok=True)
@@ -408,10 +442,30 @@ def get_prevision_data(
                 print("current directory: ", os.getcwd())
                 print(e)
                 print("******")
+            path = filepath + filename
 
-            return df, filepath + filename
-        else:
-            return df, ""
+        if binary_export == True:
+            from get_meteo.binary_export import binary_export_df
+
+            dirname = f"{code}_{prevision}_{df['date_UTC'].iloc[0].replace(' ', '_')[0:13]}h_npy"
+            try:
+                binary_export_df(
+                    df,
+                    filepath + dirname,
+                    {"code": code, "prevision": prevision, "timezone": timezone},
+                    {"date_UTC": "UTC", "date_local": timezone},
+                )
+            except Exception as e:
+                print("******")
+                print(
+                    "Error in the binary export path, see if atleast a df was returned."
+                )
+                print("current directory: ", os.getcwd())
+                print(e)
+                print("******")
+            path = filepath + dirname
+
+        return df, path
 
     except Exception as e:
         print("******")
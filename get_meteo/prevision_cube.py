@@ -0,0 +1,175 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from get_meteo.get_prevision_data import get_prevision_data
+
+# Dense forecast cube: location x model x lead time x variable, float32, nan for missing.
+# Lead times are hours after t0 (UTC), the same axis for every location and model.
+#
+# File format (single file, memory-mappable):
+#   8 bytes magic, 8 bytes little-endian length of the json header, json header
+#   (labels, shape, dtype) padded with spaces, then the raw C-order float32 data at a 64 bytes aligned offset.
+
+CUBE_MAGIC = b"METCUBE1"
+CUBE_ALIGN = 64
+
+# Numeric columns of get_prevision_data available in the cube
+CUBE_VARIABLES = [
+    "temp_degC",
+    "windchill",
+    "wind_direction_deg",
+    "mean_wind_speed_km_h",
+    "rafales_max_km_h",
+    "precipitation_mm",
+    "humidity_%",
+    "pression_hPa",
+    "nebulosity_octas",
+]
+
+
+def get_cube_header(labels, shape):
+    header = json.dumps(
+        {"labels": labels, "shape": list(shape), "dtype": "<f4"}
+    ).encode()
+    offset = len(CUBE_MAGIC) + 8 + len(header)
+    header += b" " * (-offset % CUBE_ALIGN)
+    return CUBE_MAGIC + struct.pack("<Q", len(header)) + header
+
+
+def create_prevision_cube_file(path, labels, shape):
+    """
+    Creates the cube file filled with nan.
+    Output: np.memmap (mode "r+") of the cube data, writes go straight to the file.
+    """
+    header = get_cube_header(labels, shape)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.truncate(len(header) + int(np.prod(shape)) * 4)
+    cube = np.memmap(path, dtype="<f4", mode="r+", offset=len(header), shape=shape)
+    cube[:] = np.nan
+    return cube
+
+
+def save_prevision_cube(cube, labels, path):
+    """
+    Saves a cube and its labels in a single file, see load_prevision_cube.
+    Output: path
+    """
+    header = get_cube_header(labels, cube.shape)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(np.ascontiguousarray(cube, dtype="<f4").tobytes())
+    return path
+
+
+def load_prevision_cube(path, mmap=True):
+    """
+    Inputs:
+        path: file written by save_prevision_cube or get_prevision_cube(path=...).
+        mmap: If True the data is memory-mapped (read only), slices are read on demand.
+    Output: cube (numpy array) and labels dict (codes, previsions, lead_hours, variables, t0_UTC).
+    """
+    with open(path, "rb") as f:
+        if f.read(len(CUBE_MAGIC)) != CUBE_MAGIC:
+            raise ValueError(f"{path} is not a prevision cube file")
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    offset = len(CUBE_MAGIC) + 8 + header_len
+    shape = tuple(header["shape"])
+
+    if mmap:
+        cube = np.memmap(
+            path, dtype=header["dtype"], mode="r", offset=offset, shape=shape
+        )
+    else:
+        cube = np.fromfile(path, dtype=header["dtype"], offset=offset).reshape(shape)
+    return cube, header["labels"]
+
+
+def get_prevision_cube(
+    codes,
+    previsions=("previsions-arpege-1h",),
+    variables=None,
+    n_hours=192,
+    t0="",
+    timezone="Europe/Paris",
+    path="",
+    max_workers=1,
+):
+    """
+    Inputs:
+        codes: list of meteociel location codes.
+        previsions: list of models (see get_prevision_data).
+        variables: list of numeric columns (subset of CUBE_VARIABLES), all by default.
+        n_hours: length of the lead time axis, in hours after t0.
+        t0: ["yyyy-mm-dd HH:MM:SS"] UTC start of the lead time axis, today at 00:00 UTC by default.
+        timezone: timezone of the prevision pages (see get_prevision_data).
+        path: If given the cube is written straight into this file (memory-mapped) instead of memory.
+        max_workers: number of pages fetched at the same time.
+    Output:
+        cube: float32 array (location x model x lead time x variable), nan where there is no data.
+        labels: dict with codes, previsions, lead_hours, variables and t0_UTC.
+    """
+    variables = list(CUBE_VARIABLES if variables is None else variables)
+    unknown = [variable for variable in variables if variable not in CUBE_VARIABLES]
+    if unknown:
+        raise ValueError(f"Variables {unknown} not in {CUBE_VARIABLES}")
+
+    if not t0:
+        t0 = datetime.now(dt_timezone.utc).strftime("%Y-%m-%d 00:00:00")
+    t0_ts = pd.Timestamp(t0)
+
+    codes = [str(code) for code in codes]
+    previsions = list(previsions)
+    labels = {
+        "codes": codes,
+        "previsions": previsions,
+        "lead_hours": list(range(n_hours)),
+        "variables": variables,
+        "t0_UTC": t0,
+    }
+    shape = (len(codes), len(previsions), n_hours, len(variables))
+
+    # Preallocated cube, each page writes its rows in its own (location, model) slice
+    if path:
+        cube = create_prevision_cube_file(path, labels, shape)
+    else:
+        cube = np.full(shape, np.nan, dtype=np.float32)
+
+    def fill(i, j):
+        df, _ = get_prevision_data(
+            code=codes[i], prevision=previsions[j], timezone=timezone, columns=variables
+        )
+        if df.empty:
+            return
+        lead = (pd.to_datetime(df["date_UTC"]) - t0_ts) // pd.Timedelta(hours=1)
+        lead = lead.to_numpy()
+        valid = (lead >= 0) & (lead < n_hours)
+        cube[i, j, lead[valid], :] = df[variables].to_numpy(dtype=np.float32)[valid]
+
+    units = [(i, j) for i in range(len(codes)) for j in range(len(previsions))]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda unit: fill(*unit), units))
+
+    if path:
+        cube.flush()
+
+    return cube, labels
+
+
+if __name__ == "__main__":
+    cube, labels = get_prevision_cube(
+        ["32104", "33262"],
+        ["previsions-arpege-1h", "previsions-arome-1h"],
+        path="files/meteo_tables/meteo_prev/cube.mcube",
+    )
+    cube, labels = load_prevision_cube("files/meteo_tables/meteo_prev/cube.mcube")
+    print(cube.shape, labels["t0_UTC"])
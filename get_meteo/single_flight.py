@@ -0,0 +1,74 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first thread runs the
+    function, the others wait for it and get the same result (or exception).
+    Successful results are kept in a small LRU for ttl seconds.
+    Inputs:
+        maxsize: number of results kept in the LRU, 0 disables it.
+        ttl: seconds a result stays valid in the LRU.
+    """
+
+    def __init__(self, maxsize=128, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.recent = OrderedDict()
+
+    def do(self, key, fn, use_cache=True):
+        """
+        Returns fn() for key, shared with the concurrent calls of the same key.
+        With use_cache=False the LRU is not read (a fresh result is fetched and stored).
+        """
+        with self.lock:
+            cached = self.recent.get(key) if use_cache else None
+            if cached is not None:
+                stored_at, result = cached
+                if time.monotonic() - stored_at < self.ttl:
+                    self.recent.move_to_end(key)
+                    return result
+                del self.recent[key]
+
+            call = self.in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = InFlightCall()
+                self.in_flight[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                if call.error is None and self.maxsize > 0:
+                    self.recent[key] = (time.monotonic(), call.result)
+                    while len(self.recent) > self.maxsize:
+                        self.recent.popitem(last=False)
+            call.done.set()
+
+        return call.result
+
+    def clear(self):
+        with self.lock:
+            self.recent.clear()
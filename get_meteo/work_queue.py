@@ -0,0 +1,340 @@
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from get_meteo.get_meteo_data import fetch_meteociel_day, get_ranges_of_dates
+
+# Work queue for backfills spread over several worker processes/nodes.
+# The queue is a SQLite file: units are leased for lease_seconds, kept alive by
+# heartbeats and committed once (idempotent), an expired lease goes back to the queue.
+# OBS: SQLite locking is not reliable on every network file system, for several
+# nodes put the file on a share with working locks (or run one queue per node).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expiry REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result_path TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS units_state ON units (state, lease_expiry);
+"""
+
+
+class WorkQueue:
+    """
+    Inputs:
+        db_path: SQLite file of the queue, created if needed.
+        lease_seconds: time a worker owns a unit without heartbeat.
+        max_attempts: a unit failing this number of times is marked "failed".
+    """
+
+    def __init__(
+        self,
+        db_path="files/meteo_tables/work_queue.sqlite",
+        lease_seconds=300,
+        max_attempts=3,
+    ):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def enqueue(self, kind, key, params):
+        return self.enqueue_many([(kind, key, params)])
+
+    def enqueue_many(self, units):
+        """
+        Adds (kind, key, params) units in a single transaction, keys already in the queue are ignored.
+        Output: number of units added.
+        """
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO units (kind, key, params) VALUES (?, ?, ?)",
+                ((kind, key, json.dumps(params)) for kind, key, params in units),
+            )
+            added = db.total_changes - before
+            db.execute("COMMIT")
+        return added
+
+    def enqueue_station_days(self, stations, start_date, end_date):
+        """
+        Adds one unit per (station, day), days already in the queue are ignored.
+        Output: number of units added.
+        """
+        # get_ranges_of_dates pads one day on each side for the timezone corrections
+        return self.enqueue_many(
+            (
+                "observation",
+                f"{station}_{date}",
+                {"meteostation": str(station), "date": date},
+            )
+            for date in get_ranges_of_dates(start_date, end_date)
+            for station in stations
+        )
+
+    def enqueue_previsions(self, codes, previsions, run=""):
+        """
+        Adds one unit per (code, prevision), run labels a new batch of the same pages (eg. the date).
+        Output: number of units added.
+        """
+        return self.enqueue_many(
+            (
+                "prevision",
+                f"{code}_{prevision}_{run}",
+                {"code": str(code), "prevision": prevision},
+            )
+            for code in codes
+            for prevision in previsions
+        )
+
+    def lease(self, worker):
+        """
+        Output: dict with the unit (id, kind, key, params) leased to worker, None if there is no work left.
+        An expired lease counts as a failed attempt: after max_attempts the unit is marked "failed"
+        instead of being leased again (eg. a unit killing its workers).
+        """
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE units SET state = 'failed', lease_expiry = NULL,"
+                " error = COALESCE(error, 'lease expired') WHERE state = 'leased'"
+                " AND lease_expiry < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT * FROM units WHERE state = 'pending'"
+                " OR (state = 'leased' AND lease_expiry < ?) ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE units SET state = 'leased', worker = ?, lease_expiry = ?,"
+                " attempts = attempts + 1 WHERE id = ?",
+                (worker, now + self.lease_seconds, row["id"]),
+            )
+            db.execute("COMMIT")
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "key": row["key"],
+            "params": json.loads(row["params"]),
+        }
+
+    def heartbeat(self, unit_id, worker):
+        """
+        Extends the lease. Output: False if the worker doesn't own the unit anymore.
+        """
+        with self.connect() as db:
+            cursor = db.execute(
+                "UPDATE units SET lease_expiry = ? WHERE id = ? AND worker = ?"
+                " AND state = 'leased'",
+                (time.time() + self.lease_seconds, unit_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def commit(self, unit_id, worker, result_path):
+        """
+        Marks the unit as done with its result. Committing a unit already done is a no-op,
+        so a worker that lost its lease but finished the same unit doesn't break anything.
+        Output: True if this call marked the unit as done.
+        """
+        with self.connect() as db:
+            cursor = db.execute(
+                "UPDATE units SET state = 'done', worker = ?, result_path = ?,"
+                " lease_expiry = NULL, error = NULL WHERE id = ? AND state != 'done'",
+                (worker, result_path, unit_id),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, unit_id, worker, error):
+        """
+        Gives back the unit to the queue, or marks it "failed" after max_attempts.
+        """
+        with self.connect() as db:
+            db.execute(
+                "UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " lease_expiry = NULL, error = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                (self.max_attempts, str(error), unit_id, worker),
+            )
+
+    def stats(self):
+        """
+        Output: dict {state: number of units}.
+        """
+        with self.connect() as db:
+            return dict(
+                db.execute(
+                    "SELECT state, COUNT(*) FROM units GROUP BY state"
+                ).fetchall()
+            )
+
+
+def write_csv_atomic(df, path):
+    # Writing to a temporary file first, so a result is never half written
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def run_unit(unit, output_dir, timezone="Europe/Paris"):
+    """
+    Runs the scraping of a unit and writes its csv in output_dir.
+    Output: path of the csv, "" if the page has no data. Raises on scraping errors.
+    """
+    import pandas as pd
+
+    params = unit["params"]
+    if unit["kind"] == "observation":
+        columns, status = fetch_meteociel_day(params["date"], params["meteostation"])
+        if status == "error":
+            raise RuntimeError(f"Error in scraping {unit['key']}")
+        if status == "empty":
+            return ""
+        path = os.path.join(
+            output_dir,
+            "meteociel_scraping",
+            params["meteostation"],
+            f"{params['meteostation']}_{params['date']}.csv",
+        )
+        write_csv_atomic(pd.DataFrame(columns), path)
+        return path
+
+    if unit["kind"] == "prevision":
+        from get_meteo.get_prevision_data import scrape_prevision_page
+
+        url = f"https://www.meteociel.fr/{params['prevision']}/{params['code']}/neimportepaslaville.htm"
+        df = scrape_prevision_page(url, timezone)
+        if df.empty:
+            return ""
+        path = os.path.join(
+            output_dir,
+            "meteo_prev",
+            f"{params['code']}_{params['prevision']}_{df['date_UTC'].iloc[0].replace(' ', '_')[0:13]}h.csv",
+        )
+        write_csv_atomic(df, path)
+        return path
+
+    raise ValueError(f"Unknown unit kind {unit['kind']}")
+
+
+def run_worker(
+    db_path="files/meteo_tables/work_queue.sqlite",
+    output_dir="files/meteo_tables/",
+    worker="",
+    lease_seconds=300,
+    timezone="Europe/Paris",
+    wait_for_work=False,
+    max_attempts=3,
+):
+    """
+    Leases and runs units until the queue is empty (or forever with wait_for_work=True).
+    Inputs:
+        db_path: SQLite file of the queue.
+        output_dir: shared folder where the csv results are written.
+        worker: name of the worker, hostname-pid by default.
+        max_attempts: a unit failing (or losing its lease) this number of times is marked "failed".
+    Output: number of units done by this worker.
+    """
+    queue = WorkQueue(db_path, lease_seconds, max_attempts)
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    n_done = 0
+
+    while True:
+        unit = queue.lease(worker)
+        if unit is None:
+            if not wait_for_work:
+                return n_done
+            time.sleep(lease_seconds / 10)
+            continue
+
+        # Heartbeats keep the lease while the unit runs
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(lease_seconds / 3):
+                if not queue.heartbeat(unit["id"], worker):
+                    return
+
+        heart = threading.Thread(target=beat, daemon=True)
+        heart.start()
+        try:
+            result_path = run_unit(unit, output_dir, timezone)
+        except Exception as e:
+            print("******")
+            print("Error in unit ", unit["key"])
+            print(e)
+            print("******")
+            queue.fail(unit["id"], worker, e)
+        else:
+            queue.commit(unit["id"], worker, result_path)
+            n_done += 1
+        finally:
+            stop.set()
+            heart.join()
+
+
+if __name__ == "__main__":
+    # Ex: python -m get_meteo.work_queue enqueue --stations 7157 7149 --start 2000-01-01 --end 2020-12-31
+    #     python -m get_meteo.work_queue worker   (one per process/node)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["enqueue", "worker", "stats"])
+    parser.add_argument("--db", default="files/meteo_tables/work_queue.sqlite")
+    parser.add_argument("--output", default="files/meteo_tables/")
+    parser.add_argument("--stations", nargs="*", default=[])
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--codes", nargs="*", default=[])
+    parser.add_argument("--previsions", nargs="*", default=["previsions-arpege-1h"])
+    parser.add_argument("--run", default="")
+    parser.add_argument("--lease", type=float, default=300)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--wait", action="store_true")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.db, args.lease, args.max_attempts)
+    if args.command == "enqueue":
+        added = 0
+        if args.stations:
+            added += queue.enqueue_station_days(args.stations, args.start, args.end)
+        if args.codes:
+            added += queue.enqueue_previsions(args.codes, args.previsions, args.run)
+        print(f"{added} units added")
+    elif args.command == "worker":
+        n_done = run_worker(
+            args.db,
+            args.output,
+            lease_seconds=args.lease,
+            wait_for_work=args.wait,
+            max_attempts=args.max_attempts,
+        )
+        print(f"{n_done} units done")
+    print(queue.stats())